@@ -11,10 +11,108 @@ bundle.py — Сборщик исходного кода в единый Markdow
 import argparse
 import os
 import sys
-import base64
+import binascii
 import fnmatch
-from pathlib import Path
-from charset_normalizer import from_path
+import functools
+import io
+import operator
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from charset_normalizer import from_bytes
+
+# Предел буфера выходного файла: бандл до этого размера уходит на диск одной записью
+OUTPUT_BUFFER_SIZE = 16 << 20
+
+# Начальный фрагмент, в котором ищутся нулевые байты (признак бинарного файла)
+BINARY_PROBE_SIZE = 4096
+
+# Бинарные файлы не больше этого размера, уже прочитанные при проверке на нули,
+# остаются в памяти до вывода; у крупных проверяется только начало, а base64 пишется потоком из файла
+BINARY_CACHE_LIMIT = 1 << 20
+
+# Общий объём таких бинарных файлов в памяти; сверх него они тоже перечитываются потоком
+BINARY_CACHE_BUDGET = 64 << 20
+
+# Тело файла короче этого склеивается с разметкой в один блок; длиннее — пишется как есть,
+# чтобы не копировать крупные файлы лишний раз
+INLINE_BODY_LIMIT = 64 << 10
+
+# Бинарный файл короче этого кодируется в base64 в памяти и уходит в вывод вместе с блоком;
+# длиннее — base64 пишется отдельно
+INLINE_BASE64_LIMIT = 64 << 10
+
+# Сколько строк лога копится перед записью в stderr
+LOG_BATCH_LINES = 1000
+
+# Порция для потокового base64: кратна 3 (и 57 — длине строки MIME), чтобы стыки не давали '='
+BASE64_CHUNK_SIZE = 57 * 1024
+
+# Объём начального фрагмента, по которому charset_normalizer определяет кодировку
+DETECT_SAMPLE_SIZE = 64 * 1024
+
+# BOM UTF-32 проверяются раньше UTF-16: BOM UTF-32 LE начинается с BOM UTF-16 LE
+_BOMS = (
+    (b'\xff\xfe\x00\x00', 'utf-32'),
+    (b'\x00\x00\xfe\xff', 'utf-32'),
+    (b'\xff\xfe', 'utf-16'),
+    (b'\xfe\xff', 'utf-16'),
+)
+
+# Управляющие символы C0, которых не бывает в тексте (кроме \t, \n, \r): строгое декодирование
+# UTF-16 принимает почти любые байты чётной длины, и только так BOM отличается от случайного начала данных
+_C0_CONTROLS = re.compile(rb'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Расширения заведомо бинарных форматов (без явной --encoding детект для них не запускается)
+_BINARY_EXTENSIONS = frozenset({
+    'png', 'jpg', 'jpeg', 'gif', 'bmp', 'ico', 'webp', 'tif', 'tiff',
+    'zip', 'gz', 'tgz', 'bz2', 'xz', '7z', 'rar', 'jar', 'whl',
+    'exe', 'dll', 'so', 'dylib', 'o', 'a', 'lib', 'pyc', 'class', 'bin', 'iso',
+    'pdf', 'woff', 'woff2', 'ttf', 'otf', 'mp3', 'mp4', 'avi', 'wav',
+})
+
+# Флаги выражений масок имён: как и fnmatch.fnmatch, на Windows сравнение без учёта регистра
+_GLOB_FLAGS = re.IGNORECASE if os.name == 'nt' else 0
+
+# Проверка «только ASCII»: bytes.isascii (3.7+) либо удаление всех ASCII-байтов через translate
+_bytes_isascii = getattr(bytes, 'isascii', None)
+_ASCII_BYTES = bytes(range(128))
+
+# Ключ сортировки записей каталога — как сравнение частей в Path: на Windows без учёта регистра,
+# на POSIX имя как есть
+if os.name == 'nt':
+    _entry_sort_key = lambda entry: entry.name.lower()
+else:
+    _entry_sort_key = operator.attrgetter('name')
+
+# Постоянные фрагменты разметки кодируются в байты один раз при загрузке модуля
+_SEP = b"---\n"
+_FENCE = b"```\n"
+_FENCE_BASE64 = b"```base64\n"
+_FENCE_END = b"\n```\n"
+_DIRECTORY_BLOCK = b"```\n# directory\n```\n"
+_PATH_ONLY_BLOCK = b"```\n# path only\n```\n"
+
+# Расширение -> язык подсветки там, где расширение не совпадает с именем лексера
+# или неоднозначно (заголовки .h в проектах на C++ — C++)
+_EXT2LANG = {
+    'py': 'python', 'pyw': 'python', 'md': 'markdown', 'txt': 'text',
+    'h': 'cpp', 'hh': 'cpp', 'hpp': 'cpp', 'hxx': 'cpp', 'cc': 'cpp', 'cxx': 'cpp',
+    'js': 'javascript', 'mjs': 'javascript', 'cjs': 'javascript', 'ts': 'typescript',
+    'rs': 'rust', 'rb': 'ruby', 'cs': 'csharp', 'kt': 'kotlin', 'pl': 'perl',
+    'sh': 'bash', 'bat': 'batch', 'cmd': 'batch', 'ps1': 'powershell', 'yml': 'yaml',
+}
+
+# Расширение -> открывающее ограждение кода (заполняется по мере встречи расширений)
+_FENCE_CACHE = {}
+
+def write_log(lines):
+    """Вывести накопленные строки лога в stderr одной записью и очистить список"""
+    if lines:
+        sys.stderr.write("\n".join(lines) + "\n")
+        sys.stderr.flush()
+        lines.clear()
+
 
 def show_short_help():
     print("""
@@ -76,15 +174,22 @@ def expand_patterns_file(argv):
             i += 1
     return new_argv
 
-def is_binary_file(path, sample_size=4096):
-    try:
-        with open(path, 'rb') as f:
-            sample = f.read(sample_size)
-            if b'\x00' in sample:
-                return True
-            return False
-    except Exception:
-        return True
+def file_extension(name):
+    """Расширение имени файла без точки (правила как у Path.suffix: у '.gitignore' и 'a.' его нет)"""
+    dot = name.rfind('.')
+    return name[dot + 1:] if 0 < dot < len(name) - 1 else ""
+
+
+def is_ascii(data):
+    """Данные состоят только из байтов < 0x80 (bytes.isascii есть с Python 3.7, для 3.6 — translate)"""
+    if _bytes_isascii is not None:
+        return _bytes_isascii(data)
+    return not data.translate(None, _ASCII_BYTES)
+
+
+def is_binary_data(data, sample_size=BINARY_PROBE_SIZE):
+    """Признак бинарного содержимого: нулевой байт в первых sample_size байтах"""
+    return data.find(b'\x00', 0, sample_size) != -1
 
 def normalize_pattern(pat):
     """Нормализует шаблоны для интуитивного поведения (совместимость с Windows CMD)"""
@@ -97,123 +202,338 @@ def normalize_pattern(pat):
         return '*'
     return pat
 
+@functools.lru_cache(maxsize=64)
 def normalize_encoding_name(enc):
     if not enc:
         return "unknown"
     return enc.lower().replace('_', '-').replace('utf8', 'utf-8')
 
 
-def read_file_with_encoding(path, explicit_encoding=None):
-    if is_binary_ofile(path):
-        return None, "binary", True, True, None
+def read_bytes(path, size=-1):
+    """
+    Прочитать файл целиком через os.open/os.read, без буферизованного файлового объекта.
+    size: ожидаемый размер (st_size); читается size + 1 байт, остаток — только если чтение
+    вернуло не ровно size байт (оборвалось раньше или файл вырос)
+    """
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        if size < 0:
+            size = os.fstat(fd).st_size
+        data = os.read(fd, size + 1)
+        if len(data) == size:
+            return data
+        chunks = [data]
+        while True:
+            block = os.read(fd, max(size + 1 - len(data), 1 << 16))
+            if not block:
+                break
+            chunks.append(block)
+        return b"".join(chunks)
+    finally:
+        os.close(fd)
+
 
+def read_head(path, length):
+    """Прочитать не больше length начальных байт файла"""
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
     try:
-        with open(path, "rb") as f:
-            raw_bytes = f.read()
-    except Exception as e:
-        return None, None, False, False, f"Ошибка чтения: {e}"
+        return os.read(fd, length)
+    finally:
+        os.close(fd)
 
-    encoding = explicit_encoding
-    if not encoding:
-        results = from_path(path).best()
-        if results:
-            encoding = results.encoding
 
-    if not encoding:
-        encoding = "utf-8"
+def normalize_newlines(data):
+    """Привести CRLF и одиночный CR к LF на уровне bytes"""
+    if b'\r' not in data:
+        return data
+    data = data.replace(b'\r\n', b'\n')
+    if b'\r' in data:
+        data = data.replace(b'\r', b'\n')
+    return data
 
+
+@functools.lru_cache(maxsize=None)
+def has_ascii_newlines(encoding):
+    """Кодировка хранит CR и LF одиночными ASCII-байтами, и переводы строк можно нормализовать до декодирования"""
     try:
+        return '\r\n'.encode(encoding) == b'\r\n'
+    except (LookupError, UnicodeError):
+        return False
+
+
+def detect_bom(data):
+    """Кодировка UTF-16/32 по BOM в начале данных или None (UTF-8 с BOM проходит быстрый путь UTF-8)"""
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return encoding
+    return None
+
+
+def detect_encoding(data):
+    """
+    Определить кодировку через charset_normalizer по начальному фрагменту данных.
+    Фрагмент обрезается по последнему переводу строки, чтобы не разрывать многобайтовый символ
+    """
+    sample = data[:DETECT_SAMPLE_SIZE]
+    if len(sample) < len(data):
+        cut = sample.rfind(b'\n')
+        if cut > 0:
+            sample = sample[:cut + 1]
+    results = from_bytes(sample).best()
+    return results.encoding if results else None
+
+
+def decode_body(raw_bytes, encoding):
+    """
+    Декодировать байты, привести переводы строк к LF и закодировать текст в UTF-8 для вывода.
+    Возвращает (body, needs_base64); ошибки декодирования (UnicodeDecodeError, LookupError) не перехватывает
+    """
+    if has_ascii_newlines(encoding):
+        normalized_text = normalize_newlines(raw_bytes).decode(encoding)
+    else:
+        # UTF-16/32 и подобные: CR/LF не одиночные байты, нормализуем уже декодированный текст
         text_with_original_line_endings = raw_bytes.decode(encoding)
-        normalized_text = text_with_original_line_endings.replace('\r\n', '\n').replace('\r', '\n')
-        normalized_enc = normalize_encoding_name(encoding)
-        is_utf8_family = normalized_enc in ['utf-8', 'utf-8-sig', 'utf-8-bom', 'utf8', 'utf8-sig']
-        needs_base64 = not is_utf8_family
-        return normalized_text, encoding, needs_base64, False, None
+        normalized_text = text_with_original_line_endings
+        if '\r' in normalized_text:
+            normalized_text = normalized_text.replace('\r\n', '\n')
+            if '\r' in normalized_text:
+                normalized_text = normalized_text.replace('\r', '\n')
+    normalized_enc = normalize_encoding_name(encoding)
+    is_utf8_family = normalized_enc in ['utf-8', 'utf-8-sig', 'utf-8-bom', 'utf8', 'utf8-sig']
+    return normalized_text.encode('utf-8'), not is_utf8_family
+
+
+def read_file_with_encoding(path, explicit_encoding=None, entry=None):
+    """
+    Прочитать файл, определить бинарность и кодировку.
+    Возвращает (body, encoding, needs_base64, is_binary, error, raw_bytes): body — текст в UTF-8
+    с переводами строк LF, raw_bytes — исходные байты (None, если файл не читался целиком)
+    """
+    try:
+        size = entry.stat().st_size if entry is not None else os.stat(path).st_size
+        if not explicit_encoding:
+            name = entry.name if entry is not None else os.path.basename(path)
+            # Заведомо бинарные форматы не читаются: достаточно проверить, что файл открывается
+            if file_extension(name).lower() in _BINARY_EXTENSIONS:
+                os.close(os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0)))
+                return None, "binary", True, True, None, None
+        if size > BINARY_CACHE_LIMIT:
+            # Крупный бинарный файл распознаётся по началу и целиком не читается
+            head = read_head(path, BINARY_PROBE_SIZE)
+            if is_binary_data(head) and (explicit_encoding or not detect_bom(head)):
+                return None, "binary", True, True, None, None
+        raw_bytes = read_bytes(path, size)
+    except Exception as e:
+        return None, None, False, False, f"Ошибка чтения: {e}", None
+
+    if explicit_encoding:
+        return decode_explicit(raw_bytes, explicit_encoding)
+    return decode_detected(raw_bytes)
+
+
+def decoded_result(raw_bytes, encoding):
+    """Результат read_file_with_encoding для текста в заданной кодировке; неудачное декодирование — ошибка"""
+    try:
+        body, needs_base64 = decode_body(raw_bytes, encoding)
     except (UnicodeDecodeError, LookupError) as e:
-        return None, encoding, True, True, f"Декодирование {encoding} не удалось: {e}"
+        return None, encoding, True, True, f"Декодирование {encoding} не удалось: {e}", raw_bytes
+    return body, encoding, needs_base64, False, None, raw_bytes
 
 
-def is_binary_ofile(path):
-    """Alias for is_binary_file to avoid confusion in main logic"""
-    return is_binary_file(path)
+def decode_detected(raw_bytes):
+    """
+    Разбор прочитанных байтов без --encoding (общий случай): BOM, проверка на нули,
+    быстрый путь UTF-8 и лишь затем детект charset_normalizer
+    """
+    # BOM UTF-16/32 проверяется до поиска нулей: в таком тексте нулевые байты — обычное дело
+    bom_encoding = detect_bom(raw_bytes)
+    if bom_encoding:
+        try:
+            body, needs_base64 = decode_body(raw_bytes, bom_encoding)
+        except UnicodeDecodeError:
+            pass  # BOM случайный — решает проверка на нули
+        else:
+            # Управляющие символы в «тексте» — признак бинарных данных со случайным BOM
+            if _C0_CONTROLS.search(body) is None:
+                return body, bom_encoding, needs_base64, False, None, raw_bytes
 
+    if is_binary_data(raw_bytes):
+        return None, "binary", True, True, None, raw_bytes
+
+    # ASCII и корректный UTF-8 выводятся как есть, без детекта кодировки
+    try:
+        if not is_ascii(raw_bytes):
+            raw_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    else:
+        return normalize_newlines(raw_bytes), 'utf-8', False, False, None, raw_bytes
+
+    result = decoded_result(raw_bytes, detect_encoding(raw_bytes) or "utf-8")
+    if result[4] is not None and len(raw_bytes) > DETECT_SAMPLE_SIZE:
+        # Начало файла оказалось нерепрезентативным — повторный детект по всему содержимому
+        results = from_bytes(raw_bytes).best()
+        if results:
+            result = decoded_result(raw_bytes, results.encoding)
+    return result
+
+
+def decode_explicit(raw_bytes, encoding):
+    """
+    Разбор прочитанных байтов в кодировке, заданной через --encoding: без BOM, быстрых путей
+    и детекта — только проверка на нули и декодирование
+    """
+    if is_binary_data(raw_bytes):
+        return None, "binary", True, True, None, raw_bytes
+    return decoded_result(raw_bytes, encoding)
+
+
+def collect_all_paths(root, ignore_match=None):
+    """
+    Собрать все файлы и директории рекурсивно, пропуская совпавшие с ignore_match(path, is_dir).
+    Возвращает словарь {относительный путь через '/': os.DirEntry}, упорядоченный по частям пути
+    """
+    root_str = os.fspath(root)
+    paths = {}
+
+    def _scan(dir_path):
+        # Отсортированные записи директории; при обходе в глубину дают порядок по частям пути
+        try:
+            with os.scandir(dir_path) as it:
+                return sorted(it, key=_entry_sort_key)
+        except OSError:
+            return []
+
+    # Стек итераторов по директориям: встретив поддиректорию, уходим в неё,
+    # родитель продолжит с того же места
+    stack = [(iter(_scan(root_str)), "")]
+    while stack:
+        entries, rel_prefix = stack[-1]
+        for entry in entries:
+            rel = rel_prefix + entry.name
+            if entry.is_dir():
+                # Как и os.walk, не заходим в симлинки на директории
+                if entry.is_symlink() or (ignore_match is not None and ignore_match(rel, True)):
+                    continue
+                paths[rel] = entry
+                stack.append((iter(_scan(entry.path)), rel + '/'))
+                break
+            if ignore_match is not None and ignore_match(rel, False):
+                continue
+            paths[rel] = entry
+        else:
+            stack.pop()
 
-def collect_all_paths(root):
-    """Собрать все файлы и директории рекурсивно"""
-    paths = set()
-    for dirpath, dirnames, filenames in os.walk(root):
-        dirpath = Path(dirpath)
-        rel_dir = dirpath.relative_to(root)
-        if rel_dir != Path("."):
-            paths.add(rel_dir)
-        for name in filenames:
-            rel_file = rel_dir / name
-            paths.add(rel_file)
     return paths
 
 
-def match_pattern(path, pattern, is_dir):
+def classify_pattern(pattern):
     """
-    Сопоставить путь с шаблоном.
-    pattern: строка, возможно с завершающим '/'
-    is_dir: является ли path директорией
+    Разобрать шаблон на вид и значение: ("all", None) для "/", ("dir", имя) для "dir/"
+    (директория и всё её содержимое), ("path", путь) для точного пути с '/',
+    ("name", маска) для fnmatch-маски имени файла
     """
-    # Нормализуем путь к формату с '/' (кроссплатформенно)
-    path_str = str(path).replace('\\', '/')
-    
     if pattern.endswith('/'):
-        # Шаблон для директорий
-        if not is_dir:
-            return False
         dir_pattern = pattern.rstrip('/')
-        if dir_pattern == "":
-            return True  # шаблон "/" совпадает с корнем
-        # Совпадение: путь == шаблон ИЛИ путь внутри шаблона
-        return str(path) == dir_pattern or str(path).startswith(dir_pattern + '/')
-    else:
-        # Шаблон для файлов
-        if is_dir:
-            return False
-        # Если шаблон содержит '/' — это полный путь к файлу
-        if '/' in pattern:
-            return path_str == pattern
-        # Иначе — совпадение только по имени файла
-        return fnmatch.fnmatch(path.name, pattern)
+        return ("dir", dir_pattern) if dir_pattern else ("all", None)
+    if '/' in pattern:
+        return "path", pattern
+    return "name", pattern
+
+
+def compile_name_union(alternatives):
+    """Скомпилировать регулярные выражения масок имён в одно объединение; возвращает его match или None"""
+    if not alternatives:
+        return None
+    return re.compile('|'.join(alternatives), _GLOB_FLAGS).match
+
 
-def apply_patterns_to_set(current_set, root, patterns_str, action="include"):
+def compile_patterns(patterns):
     """
-    Применить список шаблонов к текущему набору путей.
-    patterns_str: строка вида "pattern1,pattern2"
-    action: "include" или "exclude"
+    Скомпилировать шаблоны в функцию match(path, is_dir) -> bool (совпал хоть один).
+    path — относительный путь через '/'.
     """
-    if not patterns_str:
-        return current_set
+    name_globs = []
+    dir_names = set()
+    exact_paths = set()
+    for pat in patterns:
+        kind, value = classify_pattern(pat)
+        if kind == "all":
+            return lambda path, is_dir: True
+        if kind == "dir":
+            dir_names.add(value)
+        elif kind == "path":
+            exact_paths.add(value)
+        elif value not in name_globs:
+            name_globs.append(value)
+
+    dir_names = frozenset(dir_names)
+    dir_prefixes = tuple(name + '/' for name in dir_names)
+    exact_paths = frozenset(exact_paths)
+    name_match = compile_name_union([fnmatch.translate(pat) for pat in name_globs])
+
+    def match(path, is_dir):
+        # Директория-шаблон совпадает сама с собой и со всем содержимым
+        if dir_prefixes and (path in dir_names or path.startswith(dir_prefixes)):
+            return True
+        if is_dir:
+            return False
+        if path in exact_paths:
+            return True
+        return name_match is not None and name_match(path.rpartition('/')[2]) is not None
 
-    patterns = [p.strip() for p in patterns_str.split(",") if p.strip()]
-    
-    all_paths = None
-    new_set = set()
-
-    if action == "include":
-        # Для включения — собираем все пути из root один раз
-        all_paths = collect_all_paths(root)
-        
-    for item in current_set if action == "exclude" else (all_paths or set()):
-        rel_path = item if isinstance(item, Path) else Path(item)
-        is_dir = (root / rel_path).is_dir()
-
-        matched = False
-        for pat in patterns:
-            if match_pattern(rel_path, pat, is_dir):
-                matched = True
-                break
+    return match
 
-        if action == "include" and matched:
-            new_set.add(rel_path)
-        elif action == "exclude" and not matched:
-            new_set.add(rel_path)
 
-    return new_set if action == "exclude" else (current_set | new_set)
+def compile_encoding_rules(rules):
+    """
+    Скомпилировать правила --encoding [(шаблон, кодировка), ...] в функцию path -> кодировка или None
+    для файлов. Побеждает первое подходящее правило.
+    """
+    globs = []
+    dir_rules = {}
+    exact_rules = {}
+    root_rule = None
+    for index, (pat, _) in enumerate(rules):
+        kind, value = classify_pattern(pat)
+        if kind == "all":
+            if root_rule is None:
+                root_rule = index
+        elif kind == "dir":
+            dir_rules.setdefault(value, index)
+        elif kind == "path":
+            exact_rules.setdefault(value, index)
+        else:
+            # Из альтернатив объединения совпадает первая — правило с меньшим номером
+            globs.append(f"(?P<r{index}>{fnmatch.translate(value)})")
+    encodings = [enc for _, enc in rules]
+    name_match = compile_name_union(globs)
+
+    def encoding_for(path):
+        candidates = [root_rule, exact_rules.get(path)]
+        if name_match is not None:
+            m = name_match(path.rpartition('/')[2])
+            if m is not None:
+                candidates.append(int(m.lastgroup[1:]))
+        if dir_rules:
+            # Директория-шаблон совпадает с путём и со всем, что лежит под ней
+            candidates.append(dir_rules.get(path))
+            pos = path.find('/')
+            while pos != -1:
+                candidates.append(dir_rules.get(path[:pos]))
+                pos = path.find('/', pos + 1)
+        matched = [i for i in candidates if i is not None]
+        return encodings[min(matched)] if matched else None
+
+    return encoding_for
+
+
+def split_patterns(patterns_str):
+    """
+    Разобрать строку вида "pattern1,pattern2" в кортеж шаблонов (пустые элементы отбрасываются).
+    Строки интернируются: разбор делается один раз в main, дальше передаются готовые кортежи
+    """
+    return tuple(sys.intern(p.strip()) for p in patterns_str.split(",") if p.strip())
 
 
 def parse_key_value_option(opt_str):
@@ -221,18 +541,98 @@ def parse_key_value_option(opt_str):
     if not opt_str:
         return []
     items = []
-    for part in opt_str.split(","):
-        part = part.strip()
-        if not part:
-            continue
+    for part in split_patterns(opt_str):
         if ":" in part:
             pat, val = part.split(":", 1)
-            items.append((normalize_pattern(pat.strip()), val.strip()))
+            items.append((sys.intern(normalize_pattern(pat.strip())), val.strip()))
         else:
-            items.append((normalize_pattern(part), True))  # для флагов вроде --no-binary-backup
+            items.append((sys.intern(normalize_pattern(part)), True))  # для флагов вроде --no-binary-backup
     return items
 
 
+def write_base64(out, data, chunk_size=BASE64_CHUNK_SIZE):
+    """
+    Записать base64 данных порциями. Размер порции кратен 3, поэтому стыки не дают '='
+    и результат совпадает с кодированием целиком, а в памяти одновременно лежит лишь одна порция.
+    """
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        out.write(binascii.b2a_base64(view[start:start + chunk_size], newline=False))
+
+
+def fence_opener(name):
+    """
+    Открывающее ограждение кода с языком по расширению имени файла: известные расширения
+    переводятся в имя языка для подсветки (_EXT2LANG), остальные подставляются как есть.
+    Готовые bytes кэшируются по расширению.
+    """
+    ext = file_extension(name)
+    fence = _FENCE_CACHE.get(ext)
+    if fence is None:
+        lang = _EXT2LANG.get(ext.lower(), ext)
+        fence = _FENCE_CACHE.setdefault(ext, f"```{lang}\n".encode('utf-8'))
+    return fence
+
+
+def write_base64_file(out, path, chunk_size=BASE64_CHUNK_SIZE):
+    """
+    Записать base64 файла, читая его порциями: целиком файл в памяти не держится.
+    Порции читаются через readinto в один и тот же буфер, без новой копии bytes на каждую
+    (буферизованный readinto дочитывает порцию целиком — стыки остаются кратны 3)
+    """
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            out.write(binascii.b2a_base64(view[:n], newline=False))
+
+
+def render_entry(rel, info):
+    """
+    Собрать Markdown-блок файла из байтовых фрагментов. Возвращает кортеж bytes:
+    обычно из одного элемента, но крупное тело файла не склеивается с разметкой
+    и идёт в вывод отдельным элементом, без лишнего копирования.
+    Если нужен base64, блок заканчивается открытым ограждением: сами данные
+    дописываются при выводе через write_base64, а затем закрываются _FENCE_END.
+    """
+    parts = [_SEP, f"## `{rel}`\n".encode('utf-8')]
+    body_index = None
+
+    if info["type"] == "path_only":
+        parts.append(_PATH_ONLY_BLOCK)
+    elif info["type"] == "error":
+        parts.append(f"<!-- bundle:error={info['error']} -->\n```text\n<<ОШИБКА: {info['error']}>>\n".encode('utf-8'))
+        parts.append(_FENCE)
+    elif info["type"] == "binary":
+        norm_enc = normalize_encoding_name(info["enc"])
+        parts.append(f"<!-- bundle:binary=true encoding={norm_enc} -->\n## `{rel}` (binary)\n".encode('utf-8'))
+        parts.append(_FENCE_BASE64)
+    else:
+        # Текстовый файл
+        body = info["body"]
+        norm_enc = normalize_encoding_name(info["enc"])
+        parts.append(f"<!-- bundle:encoding={norm_enc} -->\n".encode('utf-8'))
+        parts.append(fence_opener(rel.rpartition('/')[2]))
+        body_index = len(parts)
+        parts.append(body)
+        if body and not body.endswith(b'\n'):
+            parts.append(b'\n')
+        parts.append(_FENCE)
+
+        if info["needs_b64"]:
+            parts.append(f"\n## `{rel}` (original bytes)\n".encode('utf-8'))
+            parts.append(_FENCE_BASE64)
+
+    # Тело передаётся тем же объектом bytes, что вернуло чтение (для UTF-8 без CR —
+    # буквально прочитанные байты), и попадает в буфер вывода единственной копией
+    if body_index is not None and len(parts[body_index]) >= INLINE_BODY_LIMIT:
+        return b"".join(parts[:body_index]), parts[body_index], b"".join(parts[body_index + 1:])
+    return (b"".join(parts),)
+
+
 def main():
     if len(sys.argv) == 1:
         show_short_help()
@@ -256,8 +656,9 @@ def main():
     group.add_argument("-a", "--append", help="Добавить в файл")
     args = ap.parse_args()
     
-    root = Path(args.root).resolve()
-    if not root.exists():
+    # Корень — обычная строка: os.scandir и os.open принимают её напрямую, Path не нужен
+    root = os.path.realpath(args.root)
+    if not os.path.exists(root):
         print(f"❌ Ошибка: путь не существует: {root}", file=sys.stderr)
         return 1
 
@@ -272,68 +673,122 @@ def main():
     for po_opt in args.paths_only:
         paths_only_rules.extend(parse_key_value_option(po_opt))
 
-    all_paths = collect_all_paths(root)
+    # Строки шаблонов -p и --ignore разбираются один раз
+    include_groups = [tuple(sys.intern(normalize_pattern(p)) for p in split_patterns(s)) for s in args.patterns]
+    ignore_groups = [split_patterns(s) for s in args.ignore]
+
+    # Исключения применяются после всех включений, поэтому всё, что совпадает с --ignore,
+    # отсекается ещё при обходе: в игнорируемые директории не спускаемся,
+    # игнорируемые файлы не читаются и не проходят детект кодировки
+    ignore_match = None
+    if ignore_groups:
+        ignore_match = compile_patterns([ign for ignore_patterns in ignore_groups for ign in ignore_patterns])
+
+    all_paths = collect_all_paths(root, ignore_match)
+    # Тип каждого пути известен из обхода (d_type) — повторный stat через Path.is_dir() не нужен
+    dir_paths = {p for p, entry in all_paths.items() if entry.is_dir()}
     current_set = set()
-    file_cache = {}  # rel_path -> {type, text, enc, is_bin, needs_b64, error}
+    # rel_path -> {type, body, enc, is_bin, needs_b64, error, raw, log, chunk}; у бинарных ещё path и size
+    file_cache = {}
+    # Остаток бюджета на бинарные файлы в памяти: уменьшается из потоков пула под блокировкой
+    binary_cache_left = BINARY_CACHE_BUDGET
+    binary_cache_lock = threading.Lock()
     RED = "\033[91m"
     RESET = "\033[0m"
 
-    # 1. Обработка паттернов включения с групповым выводом
-    for pattern_str in args.patterns:
-        sub_patterns = [normalize_pattern(p.strip()) for p in pattern_str.split(",") if p.strip()]
-        for pat in sub_patterns:
-            matched = []
-            for p in all_paths:
-                is_dir = (root / p).is_dir()
-                if match_pattern(p, pat, is_dir):
-                    matched.append(p)
-
-            print(f"{pat} ({len(matched)})", file=sys.stderr)
+    # Правила компилируются один раз, а не для каждого файла
+    encoding_for = compile_encoding_rules(encoding_rules)
+    paths_only_match = compile_patterns([po for po, _ in paths_only_rules])
+    no_backup_match = compile_patterns([nb for nb, _ in no_backup_rules])
+
+    def reserve_binary_cache(raw):
+        """Оставить прочитанные байты бинарного файла в памяти, если он помещается в лимит и бюджет"""
+        if raw is None or len(raw) > BINARY_CACHE_LIMIT:
+            return None
+        nonlocal binary_cache_left
+        with binary_cache_lock:
+            if len(raw) > binary_cache_left:
+                return None
+            binary_cache_left -= len(raw)
+        return raw
+
+    def process_one(p):
+        """Классифицировать путь, прочитать файл и собрать его блок (выполняется в пуле потоков)"""
+        is_dir = p in dir_paths
+        is_po = paths_only_match(p, is_dir)
+
+        if is_po:
+            info = {"type": "path_only", "body": None, "enc": None, "is_bin": False, "needs_b64": False, "error": None, "raw": None,
+                    "log": f"  [PATH] {p}"}
+        elif is_dir:
+            # Директории выводятся заглушкой, читать нечего
+            return {"type": "directory", "log": f"  [DIR] {p}"}
+        else:
+            expl_enc = encoding_for(p)
+            disable_b64 = no_backup_match(p, False)
+
+            body, det_enc, needs_b64, is_bin, err, raw = read_file_with_encoding(all_paths[p].path, expl_enc, all_paths[p])
+            norm_enc = normalize_encoding_name(det_enc)
+
+            if err:
+                info = {"type": "error", "body": None, "enc": det_enc, "is_bin": False, "needs_b64": False, "error": err, "raw": None,
+                        "log": f"  [ERR] {p} ({err})"}
+            elif is_bin:
+                info = {"type": "binary", "body": body, "enc": det_enc, "is_bin": True, "needs_b64": True, "error": None,
+                        # Небольшой бинарный файл, уже прочитанный при проверке на нули, держим в памяти,
+                        # чтобы не читать его второй раз; крупные и не уместившиеся в общий бюджет
+                        # пишутся в base64 потоком из файла
+                        "raw": reserve_binary_cache(raw),
+                        "path": all_paths[p].path, "size": all_paths[p].stat().st_size,
+                        "log": f"  [BIN] {p} ({norm_enc})"}
+            elif norm_enc == "utf-8":
+                info = {"type": "utf8", "body": body, "enc": det_enc, "is_bin": False, "needs_b64": False, "error": None, "raw": None,
+                        "log": f"  [UTF8] {p} ({norm_enc})"}
+            else:
+                nb = needs_b64 and not disable_b64
+                info = {"type": "converted", "body": body, "enc": det_enc, "is_bin": False, "needs_b64": nb, "error": None,
+                        "raw": raw if nb else None, "log": f"  [CONV] {p} ({norm_enc})"}
+
+        # Блок собирается здесь же, в потоке; текст файла после этого не нужен.
+        # Исходные байты остаются только для base64, который пишется потоково при выводе
+        info["chunk"] = render_entry(p, info)
+        info.pop("body")
+        return info
+
+    # 1. Обработка паттернов включения с групповым выводом.
+    # Все найденные файлы сразу ставятся в пул: чтение, детект кодировок и base64 идут параллельно
+    # без остановки на границах шаблонов, а лог печатается в порядке шаблонов по мере готовности
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        groups = []
+        futures = {}
+        for sub_patterns in include_groups:
+            for pat in sub_patterns:
+                pat_match = compile_patterns((pat,))
+                matched = [p for p in all_paths if pat_match(p, p in dir_paths)]
+                groups.append((pat, matched))
+                for p in matched:
+                    if p not in futures:
+                        futures[p] = executor.submit(process_one, p)
+
+        # Строки лога копятся и уходят в stderr пачками (по группе шаблона, но не больше
+        # LOG_BATCH_LINES за раз), а не отдельным print на каждый файл
+        log_lines = []
+        for pat, matched in groups:
+            log_lines.append(f"{pat} ({len(matched)})")
             if not matched:
-                print(f"  {RED}(не найдено){RESET}", file=sys.stderr)
+                log_lines.append(f"  {RED}(не найдено){RESET}")
             else:
                 current_set.update(matched)
                 for p in matched:
-                    is_dir = (root / p).is_dir()
-                    is_po = any(match_pattern(p, po, is_dir) for po, _ in paths_only_rules)
-
-                    if is_po:
-                        file_cache[p] = {"type": "path_only", "text": None, "enc": None, "is_bin": False, "needs_b64": False, "error": None}
-                        print(f"  [PATH] {p}", file=sys.stderr)
-                        continue
-
-                    expl_enc = None
-                    for ep, e in encoding_rules:
-                        if match_pattern(p, ep, False):
-                            expl_enc = e
-                            break
-                    disable_b64 = any(match_pattern(p, nb, False) for nb, _ in no_backup_rules)
-
-                    text, det_enc, needs_b64, is_bin, err = read_file_with_encoding(root / p, expl_enc)
-                    norm_enc = normalize_encoding_name(det_enc)
-
-                    if err:
-                        file_cache[p] = {"type": "error", "text": None, "enc": det_enc, "is_bin": False, "needs_b64": False, "error": err}
-                        print(f"  [ERR] {p} ({err})", file=sys.stderr)
-                    elif is_bin:
-                        file_cache[p] = {"type": "binary", "text": text, "enc": det_enc, "is_bin": True, "needs_b64": True, "error": None}
-                        print(f"  [BIN] {p} ({norm_enc})", file=sys.stderr)
-                    elif norm_enc == "utf-8":
-                        file_cache[p] = {"type": "utf8", "text": text, "enc": det_enc, "is_bin": False, "needs_b64": False, "error": None}
-                        print(f"  [UTF8] {p} ({norm_enc})", file=sys.stderr)
-                    else:
-                        nb = needs_b64 and not disable_b64
-                        file_cache[p] = {"type": "converted", "text": text, "enc": det_enc, "is_bin": False, "needs_b64": nb, "error": None}
-                        print(f"  [CONV] {p} ({norm_enc})", file=sys.stderr)
-
-    # 2. Обработка исключений
-    if args.ignore:
-        for ign_str in args.ignore:
-            ign_pats = [p.strip() for p in ign_str.split(",") if p.strip()]
-            for p in list(current_set):
-                is_dir = (root / p).is_dir()
-                if any(match_pattern(p, ign, is_dir) for ign in ign_pats):
-                    current_set.remove(p)
+                    info = file_cache.get(p)
+                    if info is None:
+                        info = file_cache[p] = futures.pop(p).result()
+                    log_lines.append(info["log"])
+                    if len(log_lines) >= LOG_BATCH_LINES:
+                        write_log(log_lines)
+            write_log(log_lines)
+
+    # 2. Исключения (--ignore) уже применены при обходе: в all_paths их нет
 
     if not current_set:
         print("⚠️  Не найдено файлов по указанным шаблонам", file=sys.stderr)
@@ -349,98 +804,99 @@ def main():
         output_mode = 'append'
         output_path = args.append
 
+    # all_paths уже упорядочен обходом — глобальная сортировка не нужна
+    sorted_paths = [p for p in all_paths if p in current_set]
+
+    # Размер бандла известен заранее: блоки уже собраны, длина base64 считается по размеру данных.
+    # Буфер подбирается под него, чтобы не держать лишнюю память и писать одним системным вызовом
+    bundle_size = 0
+    for rel in sorted_paths:
+        info = file_cache.get(rel, {})
+        bundle_size += sum(map(len, info.get("chunk", ())))
+        if info.get("type") == "binary":
+            bundle_size += (info["size"] + 2) // 3 * 4 + len(_FENCE_END)
+        elif info.get("raw") is not None:
+            bundle_size += (len(info["raw"]) + 2) // 3 * 4 + len(_FENCE_END)
+    buffer_size = max(io.DEFAULT_BUFFER_SIZE, min(bundle_size, OUTPUT_BUFFER_SIZE))
+
     if output_mode == 'stdout':
-        out = sys.stdout
-        if hasattr(sys.stdout, 'reconfigure'):
-            sys.stdout.reconfigure(newline='\n')
+        # При перенаправлении в файл или канал байты пишутся прямо в дескриптор stdout через
+        # собственный буфер того же размера: у sys.stdout.buffer он всего 8 КиБ, и крупный бандл
+        # уходил бы тысячами write(). Консоль остаётся за sys.stdout.buffer: на Windows он идёт
+        # через _WindowsConsoleIO, а сырой UTF-8 в дескриптор дал бы кракозябры в кодовой странице
+        out = sys.stdout.buffer
+        try:
+            if not sys.stdout.isatty():
+                sys.stdout.flush()
+                out = open(sys.stdout.fileno(), 'wb', buffering=buffer_size, closefd=False)
+        except (AttributeError, OSError, ValueError):
+            pass  # stdout подменён объектом без дескриптора
     else:
-        mode = 'w' if output_mode == 'write' else 'a'
-        out = open(output_path, mode, encoding='utf-8', newline='\n')
+        mode = 'wb' if output_mode == 'write' else 'ab'
+        out = open(output_path, mode, buffering=buffer_size)
 
     try:
         if output_mode != 'stdout':
-            out.write(f"# Bundle from `{root}`\n")
+            out.write(f"# Bundle from `{root}`\n".encode('utf-8'))
 
-        sorted_paths = sorted(current_set)
         # Счётчики для финальной статистики
         utf8_count = converted_count = binary_count = paths_only_count = 0
 
         for rel in sorted_paths:
-            is_dir = (root / rel).is_dir()
-            if is_dir:
-                out.write("---\n")
-                out.write(f"## `{rel}/`\n")
-                out.write("```\n")
-                out.write("# directory\n")
-                out.write("```\n")
+            if rel in dir_paths:
+                out.write(b"".join((_SEP, f"## `{rel}/`\n".encode('utf-8'), _DIRECTORY_BLOCK)))
                 continue
 
             info = file_cache.get(rel)
             if not info:
                 continue
 
-            out.write("---\n")
-            out.write(f"## `{rel}`\n")
+            # Блок файла уже собран в пуле потоков
+            raw = info["raw"]
+            if raw is not None and len(raw) < INLINE_BASE64_LIMIT:
+                # Небольшой base64 дописывается к блоку в bytearray: весь файл уходит одной записью
+                buf = bytearray().join(info["chunk"])
+                buf += binascii.b2a_base64(raw, newline=False)
+                buf += _FENCE_END
+                out.write(buf)
+            elif raw is not None:
+                out.writelines(info["chunk"])
+                write_base64(out, raw)
+                out.write(_FENCE_END)
+            elif info["type"] == "binary":
+                out.writelines(info["chunk"])
+                write_base64_file(out, info["path"])
+                out.write(_FENCE_END)
+            else:
+                out.writelines(info["chunk"])
 
             if info["type"] == "path_only":
-                out.write("```\n")
-                out.write("# path only\n")
-                out.write("```\n")
                 paths_only_count += 1
-                continue
-
-            if info["type"] == "error":
-                out.write(f"<!-- bundle:error={info['error']} -->\n")
-                out.write("```text\n")
-                out.write(f"<<ОШИБКА: {info['error']}>>\n")
-                out.write("```\n")
-                continue
-
-            if info["type"] == "binary":
-                norm_enc = normalize_encoding_name(info["enc"])
-                out.write(f"<!-- bundle:binary=true encoding={norm_enc} -->\n")
-                out.write("## `{rel}` (binary)\n")
-                out.write("```base64\n")
-                with open(root / rel, "rb") as f:
-                    out.write(base64.b64encode(f.read()).decode("ascii"))
-                out.write("\n```\n")
+            elif info["type"] == "binary":
                 binary_count += 1
-                continue
-
-            # Текстовый файл
-            text = info["text"]
-            norm_enc = normalize_encoding_name(info["enc"])
-            lang = rel.suffix[1:] if rel.suffix else ""
-            out.write(f"<!-- bundle:encoding={norm_enc} -->\n")
-            out.write(f"```{lang}\n")
-            if text and not text.endswith('\n'):
-                text += '\n'
-            out.write(text)
-            out.write("```\n")
-
-            if info["needs_b64"]:
-                out.write(f"\n## `{rel}` (original bytes)\n")
-                out.write("```base64\n")
-                with open(root / rel, "rb") as f:
-                    out.write(base64.b64encode(f.read()).decode("ascii"))
-                out.write("\n```\n")
-                converted_count += 1
-            else:
-                utf8_count += 1
-
-        out.write("\n")
-        # Финальная статистика
-        print(f"\n✅ Записано {output_path if output_path else 'stdout'}", file=sys.stderr)
-        print(f"   Всего файлов: {utf8_count + converted_count + binary_count + paths_only_count}", file=sys.stderr)
-        print(f"   • UTF-8 (без дублирования): {utf8_count}", file=sys.stderr)
-        print(f"   • Конвертировано: {converted_count}", file=sys.stderr)
-        print(f"   • Бинарные: {binary_count}", file=sys.stderr)
-        print(f"   • Только пути: {paths_only_count}", file=sys.stderr)
+            elif info["type"] != "error":
+                if info["needs_b64"]:
+                    converted_count += 1
+                else:
+                    utf8_count += 1
+
+        out.write(b"\n")
+        # Финальная статистика — одной записью
+        stats = [
+            f"\n✅ Записано {output_path if output_path else 'stdout'}",
+            f"   Всего файлов: {utf8_count + converted_count + binary_count + paths_only_count}",
+            f"   • UTF-8 (без дублирования): {utf8_count}",
+            f"   • Конвертировано: {converted_count}",
+            f"   • Бинарные: {binary_count}",
+            f"   • Только пути: {paths_only_count}",
+        ]
         if any(nb_rule[1] is True for nb_rule in no_backup_rules):
-            print(f"\n⚠️  Внимание: base64 отключён для некоторых файлов", file=sys.stderr)
+            stats.append(f"\n⚠️  Внимание: base64 отключён для некоторых файлов")
+        write_log(stats)
 
     finally:
-        if output_mode != 'stdout':
+        # Для stdout закрывается только собственный буфер (closefd=False): он сбрасывается, дескриптор остаётся
+        if out is not sys.stdout.buffer:
             out.close()
     return 0
 